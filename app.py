@@ -2,6 +2,16 @@
 
 from flask import Flask, request, jsonify, send_file, send_from_directory
 from PIL import Image
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from streaming_form_data import StreamingFormDataParser
+from streaming_form_data.targets import FileTarget
+from werkzeug.exceptions import HTTPException
+import numpy as np
+import pybase64
+import asyncio
+import logging
+import threading
 import os
 import uuid
 import io
@@ -9,20 +19,88 @@ from translator import TranslationEngine
 from compositor import TextCompositor
 from bubble_detector import BubbleDetector
 
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+log = logging.getLogger(__name__)
+
 app = Flask(__name__, static_folder='static')
 
 # Configuration
 app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10MB limit
 app.config['UPLOAD_FOLDER'] = 'uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+PNG_COMPRESS_LEVEL = 1  # Fast zlib level: ~5x less CPU than default 6, slightly larger output
+WEBP_QUALITY = 90  # Lossy WebP option for /api/translate?format=webp
+OUTPUT_FORMATS = {'png', 'webp'}
+UPLOAD_CHUNK_SIZE = 64 * 1024  # Read streamed uploads in 64KB chunks
 
 # Ensure uploads directory exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-# Initialize engines
-translator = TranslationEngine()
-compositor = TextCompositor()
-detector = None  # Lazy load (heavy model)
+# Engines are created lazily per worker process (nothing heavy at import)
+translator = None
+compositor = None
+detector = None  # Heavy OCR model
+translator_lock = threading.Lock()
+compositor_lock = threading.Lock()
+detector_lock = threading.Lock()
+
+# Worker threads for CPU-bound OCR and compositing (NumPy/PIL/torch release the GIL)
+executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+# LRU cache of detected bubbles per image_id (uploads are unique by uuid)
+DETECT_CACHE_SIZE = 32
+DETECT_CACHE = OrderedDict()
+detect_cache_lock = threading.Lock()
+
+# image_id -> saved upload path, so lookups don't probe the filesystem
+UPLOAD_INDEX = {}
+upload_index_lock = threading.Lock()
+
+
+def get_translator():
+    """Return the shared TranslationEngine, creating it on first use."""
+    global translator
+    if translator is None:
+        with translator_lock:
+            if translator is None:
+                translator = TranslationEngine()
+    return translator
+
+
+def get_compositor():
+    """Return the shared TextCompositor, creating it on first use."""
+    global compositor
+    if compositor is None:
+        with compositor_lock:
+            if compositor is None:
+                compositor = TextCompositor()
+    return compositor
+
+
+def get_detector():
+    """Return the shared BubbleDetector, loading the OCR model on first use."""
+    global detector
+    if detector is None:
+        with detector_lock:
+            if detector is None:
+                log.info("Loading bubble detector (this may take a moment)...")
+                detector = BubbleDetector()
+    return detector
+
+
+def find_upload(image_id):
+    """Resolve image_id to its saved upload path, or None if missing."""
+    with upload_index_lock:
+        image_path = UPLOAD_INDEX.get(image_id)
+    if image_path:
+        return image_path
+
+    # Fallback for uploads handled by another worker process
+    for ext in ALLOWED_EXTENSIONS:
+        path = os.path.join(app.config['UPLOAD_FOLDER'], f"{image_id}.{ext}")
+        if os.path.exists(path):
+            return path
+    return None
 
 
 def allowed_file(filename):
@@ -65,6 +143,8 @@ def upload_image():
 
         # Save file
         file.save(filepath)
+        with upload_index_lock:
+            UPLOAD_INDEX[image_id] = filepath
 
         # Get image dimensions
         with Image.open(filepath) as img:
@@ -80,16 +160,79 @@ def upload_image():
         return jsonify({'error': f'Upload failed: {str(e)}'}), 500
 
 
+@app.route('/api/upload-stream', methods=['POST'])
+def upload_image_stream():
+    """
+    Handle image upload by streaming the multipart body straight to disk.
+
+    Same contract as /api/upload, but skips Werkzeug's form parser.
+
+    Returns:
+        JSON: {image_id: str, width: int, height: int}
+    """
+    # Generate unique ID (extension is only known once the body is parsed)
+    image_id = str(uuid.uuid4())
+    partial_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{image_id}.part")
+
+    # Same client error as /api/upload when the body isn't a multipart form
+    if request.mimetype != 'multipart/form-data':
+        return jsonify({'error': 'No image file provided'}), 400
+
+    try:
+        target = FileTarget(partial_path)
+        parser = StreamingFormDataParser(headers={'Content-Type': request.content_type or ''})
+        parser.register('image', target)
+
+        # Feed request body to parser in large chunks
+        while chunk := request.stream.read(UPLOAD_CHUNK_SIZE):
+            parser.data_received(chunk)
+
+        if not target.multipart_filename:
+            return jsonify({'error': 'No image file provided'}), 400
+
+        if not allowed_file(target.multipart_filename):
+            return jsonify({'error': 'Invalid file format. Use PNG or JPEG'}), 400
+
+        ext = target.multipart_filename.rsplit('.', 1)[1].lower()
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{image_id}.{ext}")
+        os.replace(partial_path, filepath)
+        with upload_index_lock:
+            UPLOAD_INDEX[image_id] = filepath
+
+        # Get image dimensions
+        with Image.open(filepath) as img:
+            width, height = img.size
+
+        return jsonify({
+            'image_id': image_id,
+            'width': width,
+            'height': height
+        })
+
+    except HTTPException:
+        # Let Werkzeug answer with its own status (e.g. 413 over MAX_CONTENT_LENGTH)
+        raise
+
+    except Exception as e:
+        return jsonify({'error': f'Upload failed: {str(e)}'}), 500
+
+    finally:
+        # Remove leftover partial file on rejected or failed uploads
+        if os.path.exists(partial_path):
+            try:
+                os.remove(partial_path)
+            except Exception:
+                pass
+
+
 @app.route('/api/auto-detect', methods=['POST'])
-def auto_detect_bubbles():
+async def auto_detect_bubbles():
     """
     Automatically detect speech bubbles using OCR.
 
     Expects JSON: {image_id: str}
     Returns: {bubbles: [{x, y, width, height, type}]}
     """
-    global detector
-
     try:
         data = request.get_json()
         if not data or 'image_id' not in data:
@@ -98,26 +241,31 @@ def auto_detect_bubbles():
         image_id = data['image_id']
 
         # Find uploaded image
-        image_path = None
-        for ext in ALLOWED_EXTENSIONS:
-            path = os.path.join(app.config['UPLOAD_FOLDER'], f"{image_id}.{ext}")
-            if os.path.exists(path):
-                image_path = path
-                break
+        image_path = find_upload(image_id)
 
         if not image_path:
             return jsonify({'error': 'Image not found'}), 404
 
         # Lazy load detector (it's heavy!)
-        if detector is None:
-            print("Loading bubble detector (this may take a moment)...")
-            detector = BubbleDetector()
-
-        # Detect bubbles
-        bubbles = detector.detect_bubbles(image_path)
-
-        # Merge overlapping bubbles
-        bubbles = detector.merge_overlapping_bubbles(bubbles)
+        get_detector()
+
+        # Reuse OCR result if this image was already detected
+        with detect_cache_lock:
+            bubbles = DETECT_CACHE.get(image_id)
+            if bubbles is not None:
+                DETECT_CACHE.move_to_end(image_id)
+
+        if bubbles is None:
+            # Detect and merge overlapping bubbles off the request thread
+            loop = asyncio.get_running_loop()
+            bubbles = await loop.run_in_executor(executor, _detect_and_merge, image_path)
+
+            with detect_cache_lock:
+                DETECT_CACHE[image_id] = bubbles
+                while len(DETECT_CACHE) > DETECT_CACHE_SIZE:
+                    DETECT_CACHE.popitem(last=False)
+        else:
+            log.info("✓ Using cached detection for %s", image_id)
 
         # Return bubbles WITH Korean text for translation
         clean_bubbles = [
@@ -142,8 +290,33 @@ def auto_detect_bubbles():
         return jsonify({'error': f'Detection failed: {str(e)}'}), 500
 
 
+def _detect_and_merge(image_path):
+    """Run OCR detection and merge overlapping bubbles."""
+    bubble_detector = get_detector()
+    bubbles = bubble_detector.detect_bubbles(image_path)
+    return bubble_detector.merge_overlapping_bubbles(bubbles)
+
+
+def _prime_shared_page(page, batch_texts, batch_types):
+    """
+    Cache the page as shared context if at least two batches will call the API.
+
+    Batches served entirely from the translation cache (or passed through)
+    never send the page, so they don't count.
+
+    Returns:
+        str or None: page cache handle
+    """
+    translator = get_translator()
+    calling = sum(
+        translator.has_cache_misses(texts, tones)
+        for texts, tones in zip(batch_texts, batch_types)
+    )
+    return translator.prime_page_context(page) if calling > 1 else None
+
+
 @app.route('/api/translate', methods=['POST'])
-def translate_image():
+async def translate_image():
     """
     Process translation request.
 
@@ -153,8 +326,11 @@ def translate_image():
         bubbles: [{x, y, width, height, type}]
     }
 
+    Query params:
+        format: 'png' (default) or 'webp' (smaller, faster lossy encode)
+
     Returns:
-        Binary image file (PNG)
+        JSON: {image: data URL, debug: {...}}
     """
     # Store debug info to send to browser console
     debug_info = {
@@ -173,75 +349,134 @@ def translate_image():
         image_id = data['image_id']
         bubbles = data['bubbles']
 
+        output_format = request.args.get('format', 'png').lower()
+        if output_format not in OUTPUT_FORMATS:
+            return jsonify({'error': 'Invalid format. Use png or webp'}), 400
+
         # Find uploaded image
-        image_path = None
-        for ext in ALLOWED_EXTENSIONS:
-            path = os.path.join(app.config['UPLOAD_FOLDER'], f"{image_id}.{ext}")
-            if os.path.exists(path):
-                image_path = path
-                break
+        image_path = find_upload(image_id)
 
         if not image_path:
             return jsonify({'error': 'Image not found'}), 404
 
         # Load image
         image = Image.open(image_path).convert('RGB')
-        print(f"✓ Loaded image: {image_path}", flush=True)
-        print(f"✓ Processing {len(bubbles)} bubbles", flush=True)
-
-        # Sort bubbles by y-coordinate (top to bottom)
+        log.info("✓ Loaded image: %s", image_path)
+        log.info("✓ Processing %d bubbles", len(bubbles))
+
+        # Structure-of-arrays view of the bubbles; everything below indexes by bubble ID
+        xs = np.array([b['x'] for b in bubbles], dtype=np.int64)
+        ys = np.array([b['y'] for b in bubbles], dtype=np.int64)
+        ws = np.array([b['width'] for b in bubbles], dtype=np.int64)
+        hs = np.array([b['height'] for b in bubbles], dtype=np.int64)
+        boxes = np.stack([xs, ys, xs + ws, ys + hs], axis=1).tolist()
+        korean_texts = [b.get('korean_text', '') for b in bubbles]
+        bubble_types = [b.get('type', 'normal') for b in bubbles]
+        font_sizes = [b.get('font_size', 16) for b in bubbles]
+
+        # Draw order by y-coordinate (top to bottom)
         # This ensures bottom bubbles are drawn last (on top)
-        sorted_bubbles = sorted(bubbles, key=lambda b: b['y'])
+        order_by_y = np.argsort(ys, kind='stable').tolist()
 
-        # PASS 1: Draw ALL solid white blocks first (hide all Korean text)
-        print("Pass 1: Drawing white blocks to hide Korean text...", flush=True)
-        for bubble in sorted_bubbles:
-            compositor.draw_white_block(image, bubble)
+        loop = asyncio.get_running_loop()
 
-        # Batch translation: process 10 bubbles at a time
-        batch_size = 10
-        all_translations = []
-        all_debug_info = []
-
-        for i in range(0, len(sorted_bubbles), batch_size):
-            batch = sorted_bubbles[i:i + batch_size]
-
-            # Crop all bubbles and get Korean text in this batch
-            crops = [
-                image.crop((b['x'], b['y'], b['x'] + b['width'], b['y'] + b['height']))
-                for b in batch
-            ]
-            korean_texts = [b.get('korean_text', '') for b in batch]
+        # PASS 1: Draw ALL solid white blocks first (hide all Korean text)
+        log.info("Pass 1: Drawing white blocks to hide Korean text...")
+        # Work on a single writable array for the whole page; keep the original
+        # page for translation so crops and context still show the Korean text
+        page = image
+        arr = np.asarray(image).copy()
+        await loop.run_in_executor(executor, get_compositor().draw_white_blocks, arr, xs, ys, ws, hs)
+
+        # Batch translation: pack bubbles of similar size by total crop area
+        batches = TranslationEngine.plan_batches(ws * hs)
+        tasks = []
+
+        all_batch_texts = [[korean_texts[idx] for idx in ids] for ids in batches]
+        all_batch_types = [[bubble_types[idx] for idx in ids] for ids in batches]
+
+        # With several batches calling the API, upload the page once as cached context
+        page_cache = None
+        if len(batches) > 1:
+            page_cache = await loop.run_in_executor(
+                executor, _prime_shared_page, page, all_batch_texts, all_batch_types
+            )
+
+        # PASS 2 starts while batches stream: each glass overlay is rendered as
+        # soon as its translation arrives (callbacks run on the engine's thread)
+        compositor = get_compositor()
+        widths, heights = ws.tolist(), hs.tolist()
+        pending_glasses = {}
+
+        def render_glass(idx, text):
+            pending_glasses[idx] = (text, executor.submit(
+                compositor.render_glass, widths[idx], heights[idx], bubble_types[idx], font_sizes[idx], text
+            ))
+
+        def on_batch_translation(ids):
+            return lambda i, text: render_glass(ids[i], text)
+
+        for batch_num, (ids, batch_texts, batch_types) in enumerate(
+                zip(batches, all_batch_texts, all_batch_types), start=1):
+            # Crop all bubbles in this batch
+            crops = [page.crop(tuple(boxes[idx])) for idx in ids]
 
             # Translate entire batch in one API call
-            print(f"Translating batch {i//batch_size + 1}: {len(crops)} bubbles", flush=True)
-            translations, debug = translator.translate_bubbles_batch(crops, korean_texts, image)
-            all_translations.extend(translations)
+            log.info("Translating batch %d: %d bubbles", batch_num, len(crops))
+            tasks.append(get_translator().translate_bubbles_batch_async(
+                crops, batch_texts, batch_types, page, page_cache,
+                on_translation=on_batch_translation(ids)
+            ))
+
+        # Run all batch API calls concurrently, then map back to bubble IDs
+        all_translations = [None] * len(bubbles)
+        all_debug_info = []
+        try:
+            results = await asyncio.gather(*tasks)
+        finally:
+            # Drop the page cache at end of page
+            if page_cache:
+                await loop.run_in_executor(executor, get_translator().release_page_context, page_cache)
+        for ids, (translations, debug) in zip(batches, results):
+            for idx, translated_text in zip(ids, translations):
+                all_translations[idx] = translated_text
             all_debug_info.append(debug)
-            print(f"  → Got {len(translations)} translations", flush=True)
-
-        # PASS 2: Draw ALL English text with glass backgrounds (overlaps are readable)
-        print("Pass 2: Drawing English text with glass backgrounds...", flush=True)
-        for bubble, translated_text in zip(sorted_bubbles, all_translations):
-            image = compositor.draw_text_with_glass(image, bubble, translated_text)
-
-        # Clean up original upload
+        log.info("  → Got %d translations", len(all_translations))
+
+        # PASS 2: Blend ALL English text with glass backgrounds (overlaps are readable)
+        log.info("Pass 2: Drawing English text with glass backgrounds...")
+        for idx, translated_text in enumerate(all_translations):
+            if pending_glasses.get(idx, (None,))[0] != translated_text:
+                render_glass(idx, translated_text)
+        rendered = await asyncio.gather(*(asyncio.wrap_future(future) for _, future in pending_glasses.values()))
+        glasses = dict(zip(pending_glasses, rendered))
+        await loop.run_in_executor(executor, compositor.blend_glasses, arr, xs, ys, glasses, order_by_y)
+        image = Image.fromarray(arr)
+
+        # Clean up original upload, its cached detection and index entry
         try:
             os.remove(image_path)
         except Exception:
             pass
+        with detect_cache_lock:
+            DETECT_CACHE.pop(image_id, None)
+        with upload_index_lock:
+            UPLOAD_INDEX.pop(image_id, None)
 
         # Convert image to base64 for JSON response
         img_io = io.BytesIO()
-        image.save(img_io, 'PNG')
+        if output_format == 'webp':
+            image.save(img_io, 'WEBP', quality=WEBP_QUALITY, method=4)
+        else:
+            image.save(img_io, 'PNG', compress_level=PNG_COMPRESS_LEVEL, optimize=False)
         img_io.seek(0)
 
-        import base64
-        img_base64 = base64.b64encode(img_io.getvalue()).decode('utf-8')
+        # SIMD-accelerated encode (large image payloads)
+        img_base64 = pybase64.b64encode_as_string(img_io.getvalue())
 
         # Return JSON with image and debug info
         return jsonify({
-            'image': f'data:image/png;base64,{img_base64}',
+            'image': f'data:image/{output_format};base64,{img_base64}',
             'debug': {
                 'bubble_count': len(bubbles),
                 'translations': all_translations,
@@ -255,4 +490,5 @@ def translate_image():
 
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5001)
+    # Local development only; use `gunicorn wsgi:app` (see gunicorn.conf.py) in production
+    app.run(host='0.0.0.0', port=5001, threaded=True)
@@ -4,28 +4,31 @@ import easyocr
 import cv2
 import numpy as np
 from PIL import Image
+import logging
 import ssl
 import certifi
 
 # Fix SSL certificate issues on macOS
 ssl._create_default_https_context = ssl._create_unverified_context
 
+log = logging.getLogger(__name__)
+
 
 class BubbleDetector:
     """Detects speech bubbles in manhwa images using OCR."""
 
     def __init__(self):
         """Initialize EasyOCR reader for Korean text detection."""
-        print("Initializing Korean OCR detector...")
+        log.info("Initializing Korean OCR detector...")
         self.reader = easyocr.Reader(['ko'], gpu=False)
-        print("✓ OCR detector ready")
+        log.info("✓ OCR detector ready")
 
     def detect_bubbles(self, image_path, min_width=50, min_height=30, padding=10):
         """
         Detect speech bubbles in manhwa image.
 
         Args:
-            image_path: Path to manhwa image
+            image_path: Path to manhwa image, or an already decoded BGR ndarray
             min_width: Minimum bubble width in pixels
             min_height: Minimum bubble height in pixels
             padding: Extra padding around detected text (pixels)
@@ -33,56 +36,71 @@ class BubbleDetector:
         Returns:
             list: Detected bubbles as dicts with x, y, width, height, type
         """
-        # Read image
-        img = cv2.imread(image_path)
-        if img is None:
-            raise ValueError(f"Could not read image: {image_path}")
+        # Decode once into a contiguous buffer that EasyOCR can use directly
+        if isinstance(image_path, np.ndarray):
+            img = image_path
+        else:
+            img = cv2.imdecode(np.fromfile(image_path, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if img is None:
+                raise ValueError(f"Could not read image: {image_path}")
+        img = np.ascontiguousarray(img)
 
         # Detect text regions
         results = self.reader.readtext(img)
 
-        bubbles = []
-        for (bbox, text, confidence) in results:
-            # Skip low-confidence detections
-            if confidence < 0.3:
-                continue
-
-            # Extract bounding box coordinates
-            # bbox is [[x1,y1], [x2,y2], [x3,y3], [x4,y4]]
-            x_coords = [point[0] for point in bbox]
-            y_coords = [point[1] for point in bbox]
-
-            x = int(min(x_coords)) - padding
-            y = int(min(y_coords)) - padding
-            width = int(max(x_coords) - min(x_coords)) + (2 * padding)
-            height = int(max(y_coords) - min(y_coords)) + (2 * padding)
-
-            # Filter out tiny detections
-            if width < min_width or height < min_height:
-                continue
+        # Skip low-confidence detections
+        kept = [r for r in results if r[2] >= 0.3]
+        if not kept:
+            log.info("Detected 0 text regions")
+            return []
+
+        # Extract bounding box coordinates for all detections at once
+        # bboxes has shape (N, 4, 2): [[x1,y1], [x2,y2], [x3,y3], [x4,y4]] per detection
+        bboxes = np.array([r[0] for r in kept], dtype=np.float32)
+        x_min = bboxes[:, :, 0].min(axis=1)
+        x_max = bboxes[:, :, 0].max(axis=1)
+        y_min = bboxes[:, :, 1].min(axis=1)
+        y_max = bboxes[:, :, 1].max(axis=1)
+
+        xs = x_min.astype(np.int32) - padding
+        ys = y_min.astype(np.int32) - padding
+        # Estimate original text size from OCR bounding box
+        text_heights = (y_max - y_min).astype(np.int32)
+        widths = (x_max - x_min).astype(np.int32) + (2 * padding)
+        heights = text_heights + (2 * padding)
+
+        # Filter out tiny detections
+        mask = (widths >= min_width) & (heights >= min_height)
+        indices = np.flatnonzero(mask)
+        xs, ys = xs[mask], ys[mask]
+        widths, heights, text_heights = widths[mask], heights[mask], text_heights[mask]
+
+        # Ensure coordinates are within image bounds
+        np.clip(xs, 0, None, out=xs)
+        np.clip(ys, 0, None, out=ys)
+        np.minimum(widths, img.shape[1] - xs, out=widths)
+        np.minimum(heights, img.shape[0] - ys, out=heights)
+
+        # Scale font size MUCH LARGER (English needs more space than compact Korean)
+        # Use 3x multiplier, but MINIMUM 40pt for small bubbles (readability first!)
+        font_sizes = np.maximum(40, (text_heights * 3.0).astype(np.int32))
 
-            # Ensure coordinates are within image bounds
-            x = max(0, x)
-            y = max(0, y)
-            width = min(width, img.shape[1] - x)
-            height = min(height, img.shape[0] - y)
+        bubbles = []
+        for k, idx in enumerate(indices):
+            _, text, confidence = kept[idx]
 
             # Classify bubble type based on text characteristics
             bubble_type = self._classify_bubble_type(text, confidence)
 
-            # Estimate original text size from OCR bounding box
-            text_height = int(max(y_coords) - min(y_coords))
-            # Scale font size MUCH LARGER (English needs more space than compact Korean)
-            # Use 3x multiplier, but MINIMUM 40pt for small bubbles (readability first!)
-            estimated_font_size = max(40, int(text_height * 3.0))
-            print(f"  OCR detected Korean: '{text}' (confidence={confidence:.2f})", flush=True)
-            print(f"    → height={text_height}px, font_size={estimated_font_size}pt", flush=True)
+            estimated_font_size = int(font_sizes[k])
+            log.debug("  OCR detected Korean: '%s' (confidence=%.2f) → height=%dpx, font_size=%dpt",
+                      text, confidence, text_heights[k], estimated_font_size)
 
             bubbles.append({
-                'x': x,
-                'y': y,
-                'width': width,
-                'height': height,
+                'x': int(xs[k]),
+                'y': int(ys[k]),
+                'width': int(widths[k]),
+                'height': int(heights[k]),
                 'type': bubble_type,
                 'text': text,
                 'confidence': confidence,
@@ -98,9 +116,8 @@ class BubbleDetector:
             # Use median as base (more robust than average)
             target_font_size = max(40, int(median_font_size))
 
-            print(f"\nFont size normalization:", flush=True)
-            print(f"  Range: {min(font_sizes)}pt - {max(font_sizes)}pt", flush=True)
-            print(f"  Median: {median_font_size}pt → Target: {target_font_size}pt", flush=True)
+            log.debug("Font size normalization: range %dpt - %dpt, median %dpt → target %dpt",
+                      min(font_sizes), max(font_sizes), median_font_size, target_font_size)
 
             # Normalize all font sizes to be closer to target
             # Allow some variation (±20%) but keep them similar
@@ -109,9 +126,11 @@ class BubbleDetector:
                 # Blend: 70% target + 30% original (keeps some variation)
                 normalized_size = int(0.7 * target_font_size + 0.3 * original_size)
                 bubble['font_size'] = max(40, normalized_size)
-                print(f"  {original_size}pt → {bubble['font_size']}pt", flush=True)
 
-        print(f"\nDetected {len(bubbles)} text regions")
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("  Normalized font sizes: %s", [b['font_size'] for b in bubbles])
+
+        log.info("Detected %d text regions", len(bubbles))
         return bubbles
 
     def _classify_bubble_type(self, text, confidence):
@@ -153,61 +172,76 @@ class BubbleDetector:
         if len(bubbles) <= 1:
             return bubbles
 
-        merged = []
-        used = set()
+        xs = np.array([b['x'] for b in bubbles], dtype=np.int64)
+        ys = np.array([b['y'] for b in bubbles], dtype=np.int64)
+        x_maxs = xs + np.array([b['width'] for b in bubbles], dtype=np.int64)
+        y_maxs = ys + np.array([b['height'] for b in bubbles], dtype=np.int64)
+
+        # Calculate IoU (Intersection over Union) for all pairs at once
+        iou = self._iou_matrix(xs, ys, x_maxs, y_maxs)
 
-        for i, bubble1 in enumerate(bubbles):
-            if i in used:
+        # Group bubbles connected by overlaps above the threshold
+        clusters = _DisjointSet(len(bubbles))
+        for i, j in np.argwhere(np.triu(iou > overlap_threshold, k=1)):
+            clusters.union(int(i), int(j))
+
+        merged = []
+        for members in clusters.groups():
+            if len(members) == 1:
+                merged.append(bubbles[members[0]].copy())
                 continue
 
-            # Start with current bubble
-            merged_bubble = bubble1.copy()
+            # Merge cluster into one larger bubble
+            idx = np.array(members)
+            x = int(xs[idx].min())
+            y = int(ys[idx].min())
+            merged.append({
+                'x': x,
+                'y': y,
+                'width': int(x_maxs[idx].max()) - x,
+                'height': int(y_maxs[idx].max()) - y,
+                'type': bubbles[members[0]]['type'],  # Keep first bubble's type
+                'confidence': max(bubbles[m].get('confidence', 0) for m in members)
+            })
+
+        return merged
 
-            # Check for overlaps with other bubbles
-            for j, bubble2 in enumerate(bubbles[i+1:], start=i+1):
-                if j in used:
-                    continue
+    def _iou_matrix(self, xs, ys, x_maxs, y_maxs):
+        """Calculate pairwise Intersection over Union of N boxes as an N x N matrix."""
+        ix1 = np.maximum(xs[:, None], xs[None, :])
+        iy1 = np.maximum(ys[:, None], ys[None, :])
+        ix2 = np.minimum(x_maxs[:, None], x_maxs[None, :])
+        iy2 = np.minimum(y_maxs[:, None], y_maxs[None, :])
 
-                # Calculate IoU (Intersection over Union)
-                iou = self._calculate_iou(bubble1, bubble2)
+        intersection = np.clip(ix2 - ix1, 0, None) * np.clip(iy2 - iy1, 0, None)
 
-                if iou > overlap_threshold:
-                    # Merge bubbles
-                    merged_bubble = self._merge_two_bubbles(merged_bubble, bubble2)
-                    used.add(j)
+        area = (x_maxs - xs) * (y_maxs - ys)
+        union = area[:, None] + area[None, :] - intersection
 
-            merged.append(merged_bubble)
-            used.add(i)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(union > 0, intersection / union, 0.0)
 
-        return merged
 
-    def _calculate_iou(self, bubble1, bubble2):
-        """Calculate Intersection over Union of two bubbles."""
-        x1 = max(bubble1['x'], bubble2['x'])
-        y1 = max(bubble1['y'], bubble2['y'])
-        x2 = min(bubble1['x'] + bubble1['width'], bubble2['x'] + bubble2['width'])
-        y2 = min(bubble1['y'] + bubble1['height'], bubble2['y'] + bubble2['height'])
-
-        intersection = max(0, x2 - x1) * max(0, y2 - y1)
-
-        area1 = bubble1['width'] * bubble1['height']
-        area2 = bubble2['width'] * bubble2['height']
-        union = area1 + area2 - intersection
-
-        return intersection / union if union > 0 else 0
-
-    def _merge_two_bubbles(self, bubble1, bubble2):
-        """Merge two bubbles into one larger bubble."""
-        x = min(bubble1['x'], bubble2['x'])
-        y = min(bubble1['y'], bubble2['y'])
-        x_max = max(bubble1['x'] + bubble1['width'], bubble2['x'] + bubble2['width'])
-        y_max = max(bubble1['y'] + bubble1['height'], bubble2['y'] + bubble2['height'])
-
-        return {
-            'x': x,
-            'y': y,
-            'width': x_max - x,
-            'height': y_max - y,
-            'type': bubble1['type'],  # Keep first bubble's type
-            'confidence': max(bubble1.get('confidence', 0), bubble2.get('confidence', 0))
-        }
+class _DisjointSet:
+    """Minimal union-find over integer indices (lowest index is the root)."""
+
+    def __init__(self, size):
+        self.parent = list(range(size))
+
+    def find(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i, j):
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i != root_j:
+            self.parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    def groups(self):
+        """Return member lists ordered by their first (lowest) index."""
+        groups = {}
+        for i in range(len(self.parent)):
+            groups.setdefault(self.find(i), []).append(i)
+        return list(groups.values())
@@ -1,14 +1,43 @@
 """Text overlay compositor for manhwa translation."""
 
 from PIL import Image, ImageDraw, ImageFont
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import repeat
+import logging
+import numpy as np
 import os
 
+log = logging.getLogger(__name__)
+
+
+# Worker threads for per-bubble work within a page (NumPy releases the GIL on large stores)
+_POOL = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+# Shared scratch surface for text measurement (avoids a dummy image per call)
+_MEASURE_DRAW = ImageDraw.Draw(Image.new('RGB', (1, 1)))
+
+
+@lru_cache(maxsize=128)
+def _load_font(path, size):
+    """Load a TrueType font once per (path, size) and reuse it across bubbles."""
+    return ImageFont.truetype(path, size)
+
+
+@lru_cache(maxsize=128)
+def _font_and_metrics(path, size):
+    """Return (font, line_height) for (path, size), measuring the line height once."""
+    font = _load_font(path, size)
+    line_height = _MEASURE_DRAW.textbbox((0, 0), "Ay", font=font)[3]
+    return font, line_height
+
 
 class TextCompositor:
     """Handles text rendering and image compositing."""
 
     FONT_SIZES = [16, 14, 12, 10]
     PADDING = 10
+    CHAR_ASPECT = 0.55  # Average glyph width / font size (calibrated for Helvetica)
 
     # macOS system font paths
     SYSTEM_FONTS = {
@@ -20,69 +49,182 @@ class TextCompositor:
     def __init__(self):
         """Initialize compositor with font loading."""
         self.fonts = self.SYSTEM_FONTS
-        print(f"✓ Using system fonts: {self.fonts['normal']}")
+        log.info("✓ Using system fonts: %s", self.fonts['normal'])
 
-    def draw_white_block(self, image, bubble):
+    def draw_white_block(self, arr, bubble):
         """
         Draw solid white block to hide Korean text (Pass 1).
 
         Args:
-            image: PIL Image object (original manhwa page)
+            arr: NumPy uint8 array (H x W x 3) of the page, modified in place
             bubble: dict with x, y, width, height
 
         Returns:
-            PIL Image with white block applied
+            NumPy array with white block applied
         """
-        x = bubble['x']
-        y = bubble['y']
-        width = bubble['width']
-        height = bubble['height']
-
-        # Create solid white rectangle
-        white_block = Image.new('RGB', (width, height), color=(255, 255, 255))
+        self._fill_white(arr, bubble['x'], bubble['y'], bubble['width'], bubble['height'])
+        return arr
 
-        # Paste white block onto image
-        image.paste(white_block, (x, y))
+    def draw_white_blocks(self, arr, xs, ys, widths, heights):
+        """
+        Draw solid white blocks for many bubbles at once (Pass 1).
 
-        return image
+        Args:
+            arr: NumPy uint8 array (H x W x 3) of the page, modified in place
+            xs, ys, widths, heights: parallel integer arrays, one entry per bubble
 
-    def draw_text_with_glass(self, image, bubble, text):
+        Returns:
+            NumPy array with white blocks applied
+        """
+        # Blocks are all solid white, so overlapping fills can run in any order
+        list(_POOL.map(self._fill_white, repeat(arr), xs.tolist(), ys.tolist(),
+                       widths.tolist(), heights.tolist()))
+        return arr
+
+    def _fill_white(self, arr, x, y, width, height):
+        """Fill one rectangle with solid white in place (no per-bubble allocation)."""
+        # Skip empty regions
+        if width <= 0 or height <= 0:
+            return
+
+        # Clip to the page on both ends (a negative end would index from the far edge)
+        page_h, page_w = arr.shape[:2]
+        x0 = min(max(x, 0), page_w)
+        y0 = min(max(y, 0), page_h)
+        x1 = min(max(x + width, 0), page_w)
+        y1 = min(max(y + height, 0), page_h)
+        if x1 <= x0 or y1 <= y0:
+            return
+
+        arr[y0:y1, x0:x1, :] = 255
+
+    def draw_text_with_glass(self, arr, bubble, text):
         """
         Draw text with semi-transparent glass background (Pass 2).
 
         Args:
-            image: PIL Image object (with white blocks already drawn)
+            arr: NumPy uint8 array (H x W x 3) of the page with white blocks
+                already drawn, modified in place
             bubble: dict with x, y, width, height, type, font_size
             text: str (translated English text)
 
         Returns:
-            PIL Image with text overlay applied
+            NumPy array with text overlay applied
         """
-        x = bubble['x']
-        y = bubble['y']
-        width = bubble['width']
-        height = bubble['height']
-        bubble_type = bubble['type']
-        base_font_size = bubble.get('font_size', 16)
+        glass = self.render_glass(bubble['width'], bubble['height'], bubble['type'],
+                                  bubble.get('font_size', 16), text)
+        return self.blend_glass(arr, bubble['x'], bubble['y'], glass)
+
+    def draw_texts_with_glass(self, arr, xs, ys, widths, heights, bubble_types, font_sizes, texts, order):
+        """
+        Draw text with glass backgrounds for many bubbles (Pass 2).
+
+        Glass overlays are rendered concurrently, then blended one by one
+        in the given order so overlapping bubbles still stack correctly.
+
+        Args:
+            arr: NumPy uint8 array (H x W x 3) of the page, modified in place
+            xs, ys, widths, heights: parallel integer arrays, one entry per bubble
+            bubble_types: list of str (normal/shout/whisper), parallel to xs
+            font_sizes: list of int (base font size), parallel to xs
+            texts: list of str (translated English text), parallel to xs
+            order: list of bubble indices in draw order (last drawn on top)
 
-        print(f"Drawing text: bubble size={width}x{height}, base_font_size={base_font_size}pt")
+        Returns:
+            NumPy array with text overlays applied
+        """
+        widths = widths.tolist()
+        heights = heights.tolist()
+        glasses = list(_POOL.map(
+            lambda idx: self.render_glass(widths[idx], heights[idx], bubble_types[idx],
+                                          font_sizes[idx], texts[idx]),
+            order
+        ))
+        return self.blend_glasses(arr, xs, ys, dict(zip(order, glasses)), order)
+
+    def blend_glasses(self, arr, xs, ys, glasses, order):
+        """
+        Blend rendered glass overlays onto the page one by one in draw order.
+
+        Args:
+            arr: NumPy uint8 array (H x W x 3) of the page, modified in place
+            xs, ys: parallel integer arrays (top-left corners)
+            glasses: mapping of bubble index -> PIL RGBA Image (or None)
+            order: list of bubble indices in draw order (last drawn on top)
+
+        Returns:
+            NumPy array with text overlays applied
+        """
+        xs = xs.tolist()
+        ys = ys.tolist()
+        for idx in order:
+            self.blend_glass(arr, xs[idx], ys[idx], glasses.get(idx))
+        return arr
+
+    def render_glass(self, width, height, bubble_type, base_font_size, text):
+        """
+        Render text on a transparent RGBA canvas the size of the bubble.
+
+        Args:
+            width, height: int (bubble size)
+            bubble_type: str (normal/shout/whisper)
+            base_font_size: int (starting font size)
+            text: str (translated English text)
+
+        Returns:
+            PIL RGBA Image, or None for an empty bubble
+        """
+        log.debug("Drawing text: bubble size=%dx%d, base_font_size=%spt", width, height, base_font_size)
+
+        if width <= 0 or height <= 0:
+            return None
 
         # Create RGBA canvas with semi-transparent white glass effect
         glass = Image.new('RGBA', (width, height), color=(255, 255, 255, 0))  # Fully transparent initially
 
         # Render text on glass
-        glass_with_text = self._render_text_on_glass(glass, text, bubble_type, width, height, base_font_size)
-
-        # Extract region from image
-        region = image.crop((x, y, x + width, y + height)).convert('RGBA')
+        return self._render_text_on_glass(glass, text, bubble_type, width, height, base_font_size)
 
-        # Blend glass with text onto image
-        blended = Image.alpha_composite(region, glass_with_text)
+    def blend_glass(self, arr, x, y, glass):
+        """
+        Alpha-blend a rendered glass overlay onto the page in place.
 
-        # Paste back
-        image.paste(blended.convert('RGB'), (x, y))
+        Args:
+            arr: NumPy uint8 array (H x W x 3) of the page, modified in place
+            x, y: int (top-left corner of the bubble)
+            glass: PIL RGBA Image from render_glass (or None)
 
-        return image
+        Returns:
+            NumPy array with the overlay applied
+        """
+        if glass is None:
+            return arr
+
+        # Only blend the part of the glass that is visible and inside the page
+        bbox = glass.getchannel('A').getbbox()
+        if bbox is None:
+            return arr
+        x0 = max(x + bbox[0], 0)
+        y0 = max(y + bbox[1], 0)
+        x1 = min(x + bbox[2], arr.shape[1])
+        y1 = min(y + bbox[3], arr.shape[0])
+        if x1 <= x0 or y1 <= y0:
+            return arr
+
+        glass_rgba = np.asarray(glass)[y0 - y:y1 - y, x0 - x:x1 - x]
+        region = arr[y0:y1, x0:x1]
+
+        # Blend glass with text onto page region in place: out = rgb*a + region*(1-a)
+        rgb = glass_rgba[..., :3].astype(np.float32)
+        alpha = glass_rgba[..., 3:4].astype(np.float32) / 255.0
+        np.multiply(rgb, alpha, out=rgb)
+        blended = region.astype(np.float32)
+        blended *= 1.0 - alpha
+        blended += rgb
+        np.rint(blended, out=blended)
+        region[...] = blended.astype(np.uint8)
+
+        return arr
 
     def _wrap_text(self, text, font, max_width):
         """
@@ -96,7 +238,6 @@ class TextCompositor:
         Returns:
             list of str (lines of text)
         """
-        draw = ImageDraw.Draw(Image.new('RGB', (1, 1)))
         words = text.split()
         lines = []
         current_line = []
@@ -104,8 +245,7 @@ class TextCompositor:
         for word in words:
             # Try adding this word to current line
             test_line = ' '.join(current_line + [word])
-            bbox = draw.textbbox((0, 0), test_line, font=font)
-            test_width = bbox[2] - bbox[0]
+            test_width = font.getlength(test_line)
 
             if test_width <= max_width:
                 current_line.append(word)
@@ -124,6 +264,72 @@ class TextCompositor:
 
         return lines if lines else [text]
 
+    def _fit_text(self, text, font_path, font_sizes, width, height):
+        """
+        Find the largest candidate font size whose wrapped text fits the bubble.
+
+        Starts from a closed-form estimate (each glyph covers roughly
+        CHAR_ASPECT * size^2 pixels) and steps one candidate at a time
+        towards the answer, instead of trying every size from the top.
+
+        Args:
+            text: str (text to render)
+            font_path: str (font file)
+            font_sizes: list of int (candidate sizes, largest first)
+            width: int (bubble width)
+            height: int (bubble height)
+
+        Returns:
+            tuple (size, font, lines, line_height, total_height), or None if no size fits
+        """
+        if not font_sizes:
+            return None
+
+        max_text_width = width - (self.PADDING * 2)
+        max_text_height = height - (self.PADDING * 2)
+        layouts = {}
+        load_errors = []
+
+        def try_size(idx):
+            """Wrap text at font_sizes[idx]; return the layout if it fits, else None."""
+            if idx not in layouts:
+                size = font_sizes[idx]
+                layouts[idx] = None
+                try:
+                    font, line_height = _font_and_metrics(font_path, size)
+                    lines = self._wrap_text(text, font, max_text_width)
+                    total_height = line_height * len(lines)
+                    if total_height <= max_text_height:
+                        layouts[idx] = (size, font, lines, line_height, total_height)
+                except Exception as e:
+                    load_errors.append(f"{size}pt: {e}")
+            return layouts[idx]
+
+        # Snap the estimate to the nearest candidate size
+        estimate = (width * height / max(1, len(text) * self.CHAR_ASPECT)) ** 0.5
+        idx = min(range(len(font_sizes)), key=lambda i: abs(font_sizes[i] - estimate))
+
+        if try_size(idx):
+            # Fits: grow while the next larger size still fits
+            while idx > 0 and try_size(idx - 1):
+                idx -= 1
+            layout = layouts[idx]
+        else:
+            # Overflows: shrink until something fits
+            layout = None
+            while idx + 1 < len(font_sizes):
+                idx += 1
+                layout = try_size(idx)
+                if layout:
+                    break
+
+        if load_errors:
+            log.debug("  ! Failed to load font at %s", "; ".join(load_errors))
+        if layout:
+            log.debug("  → Rendered with %dpt font after %d tries, %d lines, total_height=%dpx",
+                      layout[0], len(layouts), len(layout[2]), layout[4])
+        return layout
+
     def _render_text_on_glass(self, glass, text, bubble_type, width, height, base_font_size):
         """
         Render text with semi-transparent glass background.
@@ -149,62 +355,43 @@ class TextCompositor:
             font_sizes.append(current_size)
             current_size -= 4
 
-        # Try each font size with text wrapping
-        for size in font_sizes:
-            try:
-                font = ImageFont.truetype(font_path, size)
-
-                # Wrap text into multiple lines
-                max_text_width = width - (self.PADDING * 2)
-                lines = self._wrap_text(text, font, max_text_width)
-
-                # Calculate total height needed
-                line_height = draw.textbbox((0, 0), "Ay", font=font)[3]
-                total_height = line_height * len(lines)
-
-                # Check if wrapped text fits in bubble height
-                if total_height <= height - (self.PADDING * 2):
-                    # Text fits! Draw semi-transparent glass behind text
-                    text_x = 5
-                    text_y = (height - total_height) // 2
-
-                    # Calculate glass rectangle to cover all lines
-                    max_line_width = max(
-                        draw.textbbox((0, 0), line, font=font)[2] - draw.textbbox((0, 0), line, font=font)[0]
-                        for line in lines
-                    )
-
-                    glass_padding = 3
-                    glass_rect = [
-                        text_x - glass_padding,
-                        text_y - glass_padding,
-                        text_x + max_line_width + glass_padding,
-                        text_y + total_height + glass_padding
-                    ]
-
-                    # Draw semi-transparent white glass background
-                    draw.rectangle(glass_rect, fill=(255, 255, 255, 120))  # 120/255 = 47% opacity
-
-                    # Draw each line of text
-                    current_y = text_y
-                    for line in lines:
-                        draw.text((text_x, current_y), line, fill=(0, 0, 0, 255), font=font)
-                        current_y += line_height
-
-                    print(f"  → Rendered with {size}pt font, {len(lines)} lines, total_height={total_height}px")
-                    return glass
-
-            except Exception as e:
-                print(f"  ! Failed to load font at {size}pt: {e}")
-                continue
+        # Find the largest font size whose wrapped text fits the bubble
+        layout = self._fit_text(text, font_path, font_sizes, width, height)
+        if layout is not None:
+            size, font, lines, line_height, total_height = layout
+
+            # Text fits! Draw semi-transparent glass behind text
+            text_x = 5
+            text_y = (height - total_height) // 2
+
+            # Calculate glass rectangle to cover all lines
+            max_line_width = max(font.getlength(line) for line in lines)
+
+            glass_padding = 3
+            glass_rect = [
+                text_x - glass_padding,
+                text_y - glass_padding,
+                text_x + max_line_width + glass_padding,
+                text_y + total_height + glass_padding
+            ]
+
+            # Draw semi-transparent white glass background
+            draw.rectangle(glass_rect, fill=(255, 255, 255, 120))  # 120/255 = 47% opacity
+
+            # Draw each line of text
+            current_y = text_y
+            for line in lines:
+                draw.text((text_x, current_y), line, fill=(0, 0, 0, 255), font=font)
+                current_y += line_height
+
+            return glass
 
         # Fallback: use minimum size with wrapping
         try:
-            font = ImageFont.truetype(font_path, 16)
+            font, line_height = _font_and_metrics(font_path, 16)
             max_text_width = width - (self.PADDING * 2)
             lines = self._wrap_text(text, font, max_text_width)
 
-            line_height = draw.textbbox((0, 0), "Ay", font=font)[3]
             text_y = self.PADDING
 
             for line in lines:
@@ -213,12 +400,12 @@ class TextCompositor:
                 if text_y > height - self.PADDING:
                     break  # Stop if we run out of space
 
-            print(f"  → Using fallback 16pt font with {len(lines)} lines (text too long)")
+            log.debug("  → Using fallback 16pt font with %d lines (text too long)", len(lines))
         except:
             # Emergency fallback
-            font = ImageFont.truetype(font_path, 14)
+            font = _load_font(font_path, 14)
             draw.text((5, height // 2), text[:50] + "...", fill=(0, 0, 0, 255), font=font)
-            print(f"  → Emergency fallback: truncated text")
+            log.debug("  → Emergency fallback: truncated text")
 
         return glass
 
@@ -241,7 +428,7 @@ class TextCompositor:
         bubble_type = bubble['type']
         # Use OCR-estimated font size, or default to 16
         base_font_size = bubble.get('font_size', 16)
-        print(f"Compositing: bubble size={width}x{height}, base_font_size={base_font_size}pt")
+        log.debug("Compositing: bubble size=%dx%d, base_font_size=%spt", width, height, base_font_size)
 
         # STEP 1: Draw SOLID white background to block original Korean text
         # Create completely opaque white rectangle
@@ -282,46 +469,28 @@ class TextCompositor:
             font_sizes.append(current_size)
             current_size -= 5
 
-        # Try each font size with text wrapping
-        for size in font_sizes:
-            try:
-                # Load system font at this size
-                font = ImageFont.truetype(font_path, size)
-
-                # Wrap text into multiple lines
-                max_text_width = width - (self.PADDING * 2)
-                lines = self._wrap_text(text, font, max_text_width)
-
-                # Calculate total height needed
-                line_height = draw.textbbox((0, 0), "Ay", font=font)[3]
-                total_height = line_height * len(lines)
-
-                # Check if wrapped text fits in bubble height
-                if total_height <= height - (self.PADDING * 2):
-                    # Text fits! Render it centered vertically
-                    text_y = (height - total_height) // 2
+        # Find the largest font size whose wrapped text fits the bubble
+        layout = self._fit_text(text, font_path, font_sizes, width, height)
+        if layout is not None:
+            size, font, lines, line_height, total_height = layout
 
-                    # Draw each line
-                    current_y = text_y
-                    for line in lines:
-                        draw.text((5, current_y), line, fill=(0, 0, 0), font=font)
-                        current_y += line_height
+            # Text fits! Render it centered vertically
+            text_y = (height - total_height) // 2
 
-                    print(f"  → Rendered with {size}pt font, {len(lines)} lines, total_height={total_height}px")
-                    return overlay
+            # Draw each line
+            current_y = text_y
+            for line in lines:
+                draw.text((5, current_y), line, fill=(0, 0, 0), font=font)
+                current_y += line_height
 
-            except Exception as e:
-                # Font loading failed, try next size
-                print(f"  ! Failed to load font at {size}pt: {e}")
-                continue
+            return overlay
 
         # Fallback: use minimum size with wrapping, even if it overflows slightly
         try:
-            font = ImageFont.truetype(font_path, 18)
+            font, line_height = _font_and_metrics(font_path, 18)
             max_text_width = width - (self.PADDING * 2)
             lines = self._wrap_text(text, font, max_text_width)
 
-            line_height = draw.textbbox((0, 0), "Ay", font=font)[3]
             text_y = self.PADDING
 
             for line in lines:
@@ -330,14 +499,14 @@ class TextCompositor:
                 draw.text((5, text_y), line, fill=(0, 0, 0), font=font)
                 text_y += line_height
 
-            print(f"  → Fallback: 18pt font with {len(lines)} lines")
+            log.debug("  → Fallback: 18pt font with %d lines", len(lines))
         except:
             # Emergency fallback: truncate
             try:
-                font = ImageFont.truetype(font_path, 16)
+                font = _load_font(font_path, 16)
                 truncated = self._truncate_text(text, width - self.PADDING, font)
                 draw.text((5, height // 2), truncated, fill=(0, 0, 0), font=font)
-                print(f"  → Emergency fallback: truncated text")
+                log.debug("  → Emergency fallback: truncated text")
             except:
                 pass
 
@@ -355,11 +524,9 @@ class TextCompositor:
         Returns:
             str (truncated text with '...')
         """
-        draw = ImageDraw.Draw(Image.new('RGB', (1, 1)))
-
         for i in range(len(text), 0, -1):
             truncated = text[:i] + "..."
-            bbox = draw.textbbox((0, 0), truncated, font=font)
+            bbox = _MEASURE_DRAW.textbbox((0, 0), truncated, font=font)
             if bbox[2] - bbox[0] <= max_width:
                 return truncated
 
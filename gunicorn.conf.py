@@ -0,0 +1,14 @@
+"""Gunicorn settings for Gemator (loaded automatically by `gunicorn wsgi:app`)."""
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5001')}"
+
+# Each worker loads its own OCR model, so keep process count modest and
+# use threads for concurrent requests within a worker
+worker_class = 'gthread'
+workers = int(os.getenv('GUNICORN_WORKERS', '2'))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+
+# OCR + translation of a full page can take a while
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
@@ -69,7 +69,7 @@ async function handleImageUpload(event) {
     try {
         showStatus('Uploading image...', true);
 
-        const response = await fetch('/api/upload', {
+        const response = await fetch('/api/upload-stream', {
             method: 'POST',
             body: formData
         });
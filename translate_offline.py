@@ -0,0 +1,100 @@
+"""Command-line driver for translating many manhwa pages offline.
+
+Detects bubbles on every page, translates all batches through
+TranslationEngine.translate_pages (sync calls, or one Gemini Batch API job
+with --mode batch / GEMINI_MODE=batch) and writes the composited pages.
+
+Usage:
+    python translate_offline.py page1.png page2.png -o translated/ --mode batch
+"""
+
+import argparse
+import logging
+import os
+import numpy as np
+from PIL import Image
+from translator import TranslationEngine
+from compositor import TextCompositor
+from bubble_detector import BubbleDetector
+
+log = logging.getLogger(__name__)
+
+
+def build_page(detector, image_path):
+    """
+    Detect bubbles on one page and split them into translation batches.
+
+    Returns:
+        Tuple[Image, list, list, list]: (page, bubbles, batch ID lists,
+        (bubble_crops, korean_texts, bubble_types, full_image) batches)
+    """
+    page = Image.open(image_path).convert('RGB')
+    bubbles = detector.merge_overlapping_bubbles(detector.detect_bubbles(image_path))
+
+    areas = [b['width'] * b['height'] for b in bubbles]
+    batches = TranslationEngine.plan_batches(areas)
+    page_batches = [
+        (
+            [page.crop((bubbles[idx]['x'], bubbles[idx]['y'],
+                        bubbles[idx]['x'] + bubbles[idx]['width'],
+                        bubbles[idx]['y'] + bubbles[idx]['height'])) for idx in ids],
+            [bubbles[idx].get('text', '') for idx in ids],
+            [bubbles[idx]['type'] for idx in ids],
+            page
+        )
+        for ids in batches
+    ]
+    return page, bubbles, batches, page_batches
+
+
+def composite_page(compositor, page, bubbles, translations):
+    """Hide the Korean text and draw the translations (both passes) on a copy of the page."""
+    xs = np.array([b['x'] for b in bubbles], dtype=np.int64)
+    ys = np.array([b['y'] for b in bubbles], dtype=np.int64)
+    ws = np.array([b['width'] for b in bubbles], dtype=np.int64)
+    hs = np.array([b['height'] for b in bubbles], dtype=np.int64)
+    bubble_types = [b['type'] for b in bubbles]
+    font_sizes = [b.get('font_size', 16) for b in bubbles]
+
+    arr = np.asarray(page).copy()
+    compositor.draw_white_blocks(arr, xs, ys, ws, hs)
+    compositor.draw_texts_with_glass(arr, xs, ys, ws, hs, bubble_types, font_sizes, translations,
+                                     np.argsort(ys, kind='stable').tolist())
+    return Image.fromarray(arr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Translate manhwa pages offline.')
+    parser.add_argument('pages', nargs='+', help='page images (png/jpg)')
+    parser.add_argument('-o', '--output', default='translated', help='output directory')
+    parser.add_argument('--mode', choices=('sync', 'batch'),
+                        help='translation mode (default: GEMINI_MODE or sync)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    os.makedirs(args.output, exist_ok=True)
+
+    engine = TranslationEngine(args.mode)
+    detector = BubbleDetector()
+    compositor = TextCompositor()
+
+    log.info("Detecting bubbles on %d pages...", len(args.pages))
+    built = [build_page(detector, path) for path in args.pages]
+
+    log.info("Translating in %s mode...", engine.mode)
+    results = engine.translate_pages([page_batches for _, _, _, page_batches in built])
+
+    for p, (path, (page, bubbles, batches, _)) in enumerate(zip(args.pages, built)):
+        translations = ["[Translation failed]"] * len(bubbles)
+        for b, ids in enumerate(batches):
+            batch_translations, _ = results[f"page{p}_batch{b}"]
+            for idx, translated_text in zip(ids, batch_translations):
+                translations[idx] = translated_text
+
+        out_path = os.path.join(args.output, os.path.splitext(os.path.basename(path))[0] + '.png')
+        composite_page(compositor, page, bubbles, translations).save(out_path, 'PNG')
+        log.info("✓ %s -> %s (%d bubbles)", path, out_path, len(bubbles))
+
+
+if __name__ == '__main__':
+    main()
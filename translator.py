@@ -1,256 +1,1054 @@
 """Gemini API integration for manhwa translation."""
 
-import google.generativeai as genai
+from google import genai
+from google.genai import types
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import diskcache
+import hashlib
+import httpx
+import io
+import itertools
+import json
 import os
+import tempfile
 from dotenv import load_dotenv
 from PIL import Image
+import logging
+import threading
 import time
 
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
+
+def _needs_translation(text):
+    """
+    Whether OCR text should go to Gemini.
+
+    Blank text is sent (a hand-drawn bubble has no OCR text; Gemini reads the
+    crop, which app.py takes from the page before the white fill), but text
+    without any Hangul (punctuation, "...", "!?", symbols) is passed through as-is.
+    """
+    if not text or not text.strip():
+        return True
+    return any('\uac00' <= ch <= '\ud7a3' or '\u3131' <= ch <= '\u318e' for ch in text)
+
+
+class RateLimitExceeded(RuntimeError):
+    """Client-side quota can't cover a call within TranslationEngine.RATE_MAX_DELAY."""
+
+
+class _TokenBucket:
+    """Continuously refilling token bucket (capacity tokens per period seconds)."""
+
+    def __init__(self, capacity, period=60.0):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, weight, max_delay):
+        """
+        Take weight tokens if they are available within max_delay seconds.
+
+        The balance may go negative by at most max_delay worth of refill; a
+        reservation that would need a longer wait takes nothing.
+
+        Returns:
+            float or None: seconds to wait, or None if refused
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            weight = min(weight, self.capacity)
+            delay = max(0.0, (weight - self.tokens) / self.rate)
+            if delay > max_delay:
+                return None
+            self.tokens -= weight
+            return delay
+
+    def refund(self, weight):
+        """Give back tokens from a reservation that was not used."""
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + min(weight, self.capacity))
+
+
+class _StreamedBatch:
+    """Incremental "[N] ..." parser for one streamed batch response."""
+
+    def __init__(self, count, fan_out, scan_line):
+        """
+        Args:
+            count: int (number of slots sent)
+            fan_out: list, slot -> bubble indices it answers
+            scan_line: TranslationEngine._scan_batch_line
+        """
+        self.partial = ["[Translation failed]"] * count
+        self.fan_out = fan_out
+        self.scan_line = scan_line
+        self.done = set()
+        self.current = None
+        self.buf = ''
+        self.chunks = []
+
+    @property
+    def text(self):
+        return ''.join(self.chunks)
+
+    def feed(self, piece):
+        """Add a streamed chunk; return (bubble index, text) for newly completed slots."""
+        piece = piece or ''
+        self.chunks.append(piece)
+        *lines, self.buf = (self.buf + piece).split('\n')
+
+        ready = []
+        for line in lines:
+            prev = self.current
+            self.current = self.scan_line(line, self.partial, self.current)
+            # A slot is complete once the next [N] line starts
+            if prev is not None and prev != self.current and prev not in self.done:
+                self.done.add(prev)
+                ready.extend((i, self.partial[prev]) for i in self.fan_out[prev])
+        return ready
+
+    def salvage(self, translations):
+        """Keep slots completed before a mid-stream failure over the failure result."""
+        return [self.partial[slot] if slot in self.done else trans for slot, trans in enumerate(translations)]
+
+    def remaining(self, merged):
+        """(bubble index, text) for every slot not yet emitted, from the final list."""
+        return [(i, merged[i]) for slot, indices in enumerate(self.fan_out) if slot not in self.done for i in indices]
+
 
 class TranslationEngine:
     """Handles translation via Gemini API."""
 
-    BATCH_SIZE = 10  # Translate 10 bubbles at once
-
-    PROMPTS = {
-        'normal': (
-            "Translate this Korean speech bubble to natural "
-            "conversational English. Return ONLY the translation."
-        ),
-        'shout': (
-            "Translate this Korean speech bubble to English. "
-            "This is shouted/emphasized dialogue - use energetic "
-            "language. Return ONLY the translation."
-        ),
-        'whisper': (
-            "Translate this Korean speech bubble to English. "
-            "This is internal thought or whisper - use softer, "
-            "reflective language. Return ONLY the translation."
-        )
-    }
+    # Gemini 2.5 Flash (latest stable multimodal model)
+    MODEL_NAME = 'gemini-2.5-flash'
+
+    BATCH_SIZE = 20  # Max bubbles per API call
+    BATCH_MAX_PIXELS = 2_000_000  # Max total crop area per API call
 
-    BATCH_PROMPT = """TASK: Translate {count} Korean text strings to English.
+    # Format rules and examples, sent once as the system instruction rather than per prompt
+    BATCH_SYSTEM_INSTRUCTION = """You translate Korean manhwa speech bubbles to natural English.
 
-INPUT: You will receive {count} Korean text strings, numbered [1] to [{count}].
+You receive N Korean text strings numbered [1] to [N], each with its bubble image
+and a tone tag: (normal) neutral conversational, (shout) energetic/emphasized,
+(whisper) soft/reflective for thoughts and whispers.
 
 OUTPUT REQUIREMENTS (STRICT):
-1. You MUST return EXACTLY {count} translations
-2. Each translation MUST be on its own line
-3. Each line MUST start with the number in brackets: [N]
-4. Do NOT combine multiple inputs into one translation
-5. Do NOT skip any numbers
-6. Translate even single words like "네" → [N] Yes
+1. Return EXACTLY N translations
+2. Each translation on its own line, starting with its number in brackets: [N]
+3. Do NOT combine multiple inputs into one translation
+4. Do NOT skip any numbers
+5. Translate even single words like "네" → [N] Yes
 
 EXAMPLE:
-If I give you:
-[1] Korean: 안녕
-[2] Korean: 네
-[3] Korean: 뭐야?
+If given:
+[1] (normal) Korean: 안녕
+[2] (normal) Korean: 네
+[3] (shout) Korean: 뭐야?
 
-You MUST return:
+Return:
 [1] Hello
 [2] Yes
-[3] What?
+[3] WHAT?!
 
 NOT:
 [1] Hello, yes, what?  ❌ WRONG - combined
-[1] Hello  ❌ WRONG - only 1 of 3
+[1] Hello  ❌ WRONG - only 1 of 3"""
+
+    BATCH_PROMPT = (
+        "Translate these {count} Korean texts. Output exactly {count} lines, each starting with [N]. "
+        "Tone tags: normal=neutral, shout=energetic, whisper=soft."
+    )
+
+    # Generation settings for batch calls
+    BATCH_CONFIG = types.GenerateContentConfig(
+        system_instruction=BATCH_SYSTEM_INSTRUCTION,
+        temperature=0.2,  # Lower temperature for more consistent format
+        max_output_tokens=2000  # More tokens for longer responses
+    )
 
-NOW TRANSLATE THESE {count} KOREAN TEXTS:"""
+    # Keep-alive pool for the sync HTTP transport (sync batches, page caches, Batch API)
+    # so sequential calls reuse warm TLS connections
+    HTTP_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=60)
 
-    def __init__(self):
-        """Initialize Gemini API with credentials."""
-        api_key = os.getenv('GEMINI_API_KEY')
+    # Exponential backoff with jitter on transient errors (rate limit / overload),
+    # applied by the client to every call, sync and async
+    RETRY_OPTIONS = types.HttpRetryOptions(
+        attempts=5,  # Including the first call
+        initial_delay=0.5,
+        max_delay=8.0,
+        exp_base=2.0,
+        jitter=0.5,
+        http_status_codes=[429, 500, 503, 504]
+    )
+
+    # Batch API (offline, 50% cost): polling interval and terminal job states
+    BATCH_POLL_SECONDS = 30
+    BATCH_DONE_STATES = {
+        'JOB_STATE_SUCCEEDED', 'JOB_STATE_PARTIALLY_SUCCEEDED',
+        'JOB_STATE_FAILED', 'JOB_STATE_CANCELLED', 'JOB_STATE_EXPIRED'
+    }
+    BATCH_RESULT_STATES = {'JOB_STATE_SUCCEEDED', 'JOB_STATE_PARTIALLY_SUCCEEDED'}
+
+    # Images are downscaled and sent as JPEG (vision tokens scale with pixel count)
+    CROP_MAX_SIDE = 512
+    PAGE_MAX_SIDE = 1024
+    JPEG_QUALITY = 85
+    PREP_WORKERS = 4
+
+    # Context caching: the full page is uploaded once and shared by a page's batches
+    PAGE_CACHE_TTL = '300s'
+
+    # Client-side quota per API key (override with GEMINI_RPM / GEMINI_TPM), so calls
+    # wait locally instead of discovering 429s; waits are capped at RATE_MAX_DELAY
+    DEFAULT_RPM = 1000
+    DEFAULT_TPM = 1_000_000
+    RATE_MAX_DELAY = 30.0
+    IMAGE_TOKENS = 258  # Per image tile
+
+    # On-disk translation cache shared by all workers (override with GEMATOR_CACHE_DIR)
+    CACHE_DIR = '.gemator_cache'
+    UNCACHEABLE = {"[Translation failed]", "[No text detected]"}
+
+    def __init__(self, mode=None):
+        """
+        Initialize Gemini API with credentials.
+
+        Args:
+            mode: 'sync' (interactive, default) or 'batch' (Gemini Batch API for
+                offline backlogs); defaults to GEMINI_MODE from the environment
+        """
+        # GEMINI_API_KEYS="k1,k2,k3" spreads calls over several keys' quotas
+        api_keys = [k.strip() for k in os.getenv('GEMINI_API_KEYS', '').split(',') if k.strip()]
+        if not api_keys and os.getenv('GEMINI_API_KEY'):
+            api_keys = [os.getenv('GEMINI_API_KEY')]
+
+        self.mode = mode or os.getenv('GEMINI_MODE', 'sync')
+        if self.mode not in ('sync', 'batch'):
+            raise ValueError(f"Invalid translation mode: {self.mode} (use 'sync' or 'batch')")
+
+        # Batch job name -> {key: (prompt, count)} for mapping results back
+        self._batch_jobs = {}
+
+        # Debug pass-through: GEMINI_RAW_IMAGES=1 sends full-resolution PIL images
+        self.raw_images = os.getenv('GEMINI_RAW_IMAGES') == '1'
+
+        # Background image encoding, overlapped with in-flight API calls
+        self._prep_pool = ThreadPoolExecutor(max_workers=self.PREP_WORKERS)
 
         # Test mode: set GEMINI_API_KEY=TEST to skip API calls
-        self.test_mode = (api_key == 'TEST')
+        self.test_mode = (api_keys == ['TEST'])
 
-        if not api_key:
+        if not api_keys:
             raise ValueError(
                 "GEMINI_API_KEY not found in environment. "
                 "Create .env file with your API key."
             )
 
         if not self.test_mode:
-            genai.configure(api_key=api_key)
-            # Use Gemini 2.5 Flash (latest stable multimodal model)
-            self.model = genai.GenerativeModel('models/gemini-2.5-flash')
+            # One long-lived client per key serves both sync calls and native async
+            # calls (client.aio)
+            self.clients = [
+                genai.Client(
+                    api_key=key,
+                    http_options=types.HttpOptions(
+                        client_args={'limits': self.HTTP_LIMITS},
+                        retry_options=self.RETRY_OPTIONS
+                    )
+                )
+                for key in api_keys
+            ]
+            self._client_cycle = itertools.cycle(self.clients)
+
+            # Per-key (requests, tokens) buckets
+            rpm = int(os.getenv('GEMINI_RPM', self.DEFAULT_RPM))
+            tpm = int(os.getenv('GEMINI_TPM', self.DEFAULT_TPM))
+            self._limiters = {
+                id(client): (_TokenBucket(rpm), _TokenBucket(tpm))
+                for client in self.clients
+            }
+
+            # First key owns Batch API jobs and their files
+            self.client = self.clients[0]
+
+            # Page cache handle -> client that created it (caches are per project)
+            self._cache_clients = {}
+
+            # Repeated strings (short replies, SFX, catchphrases) skip the API on hit
+            self.cache = diskcache.Cache(os.getenv('GEMATOR_CACHE_DIR', self.CACHE_DIR))
+
+            # google-genai keeps one aiohttp session per event loop, and Flask async
+            # views get a fresh loop per request; running every client.aio call on
+            # this long-lived loop keeps one warm session per key across requests
+            self._aio_loop = asyncio.new_event_loop()
+            threading.Thread(target=self._aio_loop.run_forever, name='gemini-aio', daemon=True).start()
         else:
-            print("⚠️  TEST MODE: Using dummy translations (no API calls)")
+            log.warning("⚠️  TEST MODE: Using dummy translations (no API calls)")
 
-    def translate_bubbles_batch(self, bubble_crops, korean_texts, full_image):
+    def translate_bubbles_batch(self, bubble_crops, korean_texts, bubble_types, full_image,
+                                page_cache_handle=None, prepared=None):
         """
         Translate multiple bubbles in a single API call.
 
+        Collects translate_bubbles_batch_stream into a list.
+
         Args:
             bubble_crops: List of PIL Images (cropped bubble regions)
             korean_texts: List of str (OCR-detected Korean text for each bubble)
+            bubble_types: List of str (normal/shout/whisper) for each bubble
             full_image: PIL Image (full page for context)
+            page_cache_handle: optional cache name from prime_page_context; when
+                given, full_image is not re-sent
+            prepared: optional Future from prepare_async(bubble_crops, full_image)
+                with the images already encoded
 
         Returns:
             Tuple[List[str], dict]: (Translated texts, debug info)
         """
+        translations = ["[Translation failed]"] * len(korean_texts)
+        stream = self.translate_bubbles_batch_stream(
+            bubble_crops, korean_texts, bubble_types, full_image, page_cache_handle, prepared
+        )
+        while True:
+            try:
+                i, translated_text = next(stream)
+            except StopIteration as done:
+                return translations, done.value
+            translations[i] = translated_text
+
+    def translate_bubbles_batch_stream(self, bubble_crops, korean_texts, bubble_types, full_image,
+                                       page_cache_handle=None, prepared=None):
+        """
+        Streaming version of translate_bubbles_batch.
+
+        Cache hits are yielded first; each streamed "[N] ..." line is yielded as
+        soon as the next one starts, so layout can begin before the response ends.
+
+        Args:
+            Same as translate_bubbles_batch
+
+        Yields:
+            Tuple[int, str]: (bubble index, translated text), each index once
+
+        Returns:
+            dict: debug info (as the generator's return value)
+        """
         # Test mode: return dummy text
         if self.test_mode:
-            return ["Test Translation"] * len(bubble_crops), {
-                'prompt': 'TEST MODE',
-                'response': 'Test translations',
-                'count': len(bubble_crops),
-                'korean_texts': korean_texts
-            }
+            translations, debug_info = self._test_batch_result(bubble_crops, korean_texts)
+            yield from enumerate(translations)
+            return debug_info
+
+        bubble_types = [bubble_type or 'normal' for bubble_type in bubble_types]
+        keys, cached, misses = self._lookup_cached(korean_texts, bubble_types)
+        for i, hit in enumerate(cached):
+            if hit is not None:
+                yield i, hit
+        if not misses:
+            return self._cached_batch_result(keys, cached, korean_texts)[1]
+
+        crops = [bubble_crops[i] for i in misses]
+        texts = [korean_texts[i] for i in misses]
+        tones = [bubble_types[i] for i in misses]
+        count = len(crops)
+        page = None if page_cache_handle else full_image
+        if prepared is not None:
+            crops, page = self._select_prepared(prepared.result(), misses, page is not None)
+        prompt, content = self._build_batch_content(crops, texts, tones, page)
+
+        stream = _StreamedBatch(count, self._fan_out(keys, cached, misses), self._scan_batch_line)
+
+        try:
+            log.info("  ⏳ Calling Gemini API with %d bubbles...", count)
+
+            client = self._pick_client(page_cache_handle)
+            delay = self._rate_delay(client, texts, count + (page is not None))
+            if delay:
+                time.sleep(delay)
+
+            # Single streamed API call for all uncached bubbles
+            for chunk in client.models.generate_content_stream(
+                model=self.MODEL_NAME,
+                contents=content,
+                config=self._batch_config(page_cache_handle)
+            ):
+                yield from stream.feed(chunk.text)
+
+            result = self._finish_batch(prompt, stream.text, count)
+
+        except Exception as e:
+            result = self._failed_stream(stream, prompt, count, e)
+
+        merged, debug_info = self._merge_cached(keys, cached, misses, result)
+        yield from stream.remaining(merged)
+        return debug_info
+
+    async def translate_bubbles_batch_async(self, bubble_crops, korean_texts, bubble_types, full_image,
+                                            page_cache_handle=None, prepared=None, on_translation=None):
+        """
+        Async, streaming version of translate_bubbles_batch using the native async client.
+
+        Several batches (or pages) can be in flight at once via asyncio.gather.
+        The call itself runs on the engine's background event loop, so it can be
+        awaited from any loop while reusing the same pooled connections.
+
+        Args:
+            bubble_crops: List of PIL Images (cropped bubble regions)
+            korean_texts: List of str (OCR-detected Korean text for each bubble)
+            bubble_types: List of str (normal/shout/whisper) for each bubble
+            full_image: PIL Image (full page for context)
+            page_cache_handle: optional cache name from prime_page_context; when
+                given, full_image is not re-sent
+            prepared: optional Future from prepare_async(bubble_crops, full_image)
+                with the images already encoded
+            on_translation: optional callable(bubble index, text), called once per
+                bubble as soon as its translation is known (from the engine's
+                background thread), e.g. to start layout before the batch ends
+
+        Returns:
+            Tuple[List[str], dict]: (Translated texts, debug info)
+        """
+        emit = on_translation or (lambda i, text: None)
+
+        # Test mode: return dummy text
+        if self.test_mode:
+            translations, debug_info = self._test_batch_result(bubble_crops, korean_texts)
+            for i, text in enumerate(translations):
+                emit(i, text)
+            return translations, debug_info
+
+        future = asyncio.run_coroutine_threadsafe(
+            self._translate_bubbles_batch_async(
+                bubble_crops, korean_texts, bubble_types, full_image, page_cache_handle, prepared, emit
+            ),
+            self._aio_loop
+        )
+        return await asyncio.wrap_future(future)
+
+    async def _translate_bubbles_batch_async(self, bubble_crops, korean_texts, bubble_types, full_image,
+                                             page_cache_handle, prepared, emit):
+        """translate_bubbles_batch_async body; runs on the background event loop."""
+        bubble_types = [bubble_type or 'normal' for bubble_type in bubble_types]
+        keys, cached, misses = self._lookup_cached(korean_texts, bubble_types)
+        for i, hit in enumerate(cached):
+            if hit is not None:
+                emit(i, hit)
+        if not misses:
+            return self._cached_batch_result(keys, cached, korean_texts)
+
+        crops = [bubble_crops[i] for i in misses]
+        texts = [korean_texts[i] for i in misses]
+        tones = [bubble_types[i] for i in misses]
+        count = len(crops)
+        page = None if page_cache_handle else full_image
+        if prepared is not None:
+            crops, page = self._select_prepared(await asyncio.wrap_future(prepared), misses, page is not None)
+        else:
+            # Encode off the event loop
+            crops, page = await asyncio.wrap_future(self.prepare_async(crops, page))
+        prompt, content = self._build_batch_content(crops, texts, tones, page)
+        stream = _StreamedBatch(count, self._fan_out(keys, cached, misses), self._scan_batch_line)
+
+        try:
+            log.info("  ⏳ Calling Gemini API with %d bubbles...", count)
+
+            client = self._pick_client(page_cache_handle)
+            delay = self._rate_delay(client, texts, count + (page is not None))
+            if delay:
+                await asyncio.sleep(delay)
+
+            # Single streamed API call for all uncached bubbles, awaited without blocking the event loop
+            async for chunk in await client.aio.models.generate_content_stream(
+                model=self.MODEL_NAME,
+                contents=content,
+                config=self._batch_config(page_cache_handle)
+            ):
+                for i, text in stream.feed(chunk.text):
+                    emit(i, text)
+
+            result = self._finish_batch(prompt, stream.text, count)
+
+        except Exception as e:
+            result = self._failed_stream(stream, prompt, count, e)
+
+        merged, debug_info = self._merge_cached(keys, cached, misses, result)
+        for i, text in stream.remaining(merged):
+            emit(i, text)
+        return merged, debug_info
+
+    def _test_batch_result(self, bubble_crops, korean_texts):
+        """Dummy batch result for test mode (no API calls)."""
+        return ["Test Translation"] * len(bubble_crops), {
+            'prompt': 'TEST MODE',
+            'response': 'Test translations',
+            'count': len(bubble_crops),
+            'korean_texts': korean_texts
+        }
+
+    def _cache_key(self, korean_text, bubble_type='normal'):
+        """Cache key for one string; the model name invalidates entries on upgrade."""
+        return hashlib.sha256(f"{korean_text}|{bubble_type}|{self.MODEL_NAME}".encode('utf-8')).hexdigest()
+
+    def _lookup_cached(self, korean_texts, bubble_types):
+        """
+        Look up each (Korean text, bubble type) pair in the translation cache.
+
+        Blank texts are never cached since their translation depends on the crop
+        alone. Texts with no Hangul keep their original text without an API call.
+        Repeated misses (e.g. the same SFX twice) are only sent once, using the
+        first occurrence's crop.
+
+        Returns:
+            Tuple[list, list, list]: (keys, cached/passthrough translation or None,
+                unique miss indices)
+        """
+        keys = [
+            self._cache_key(t, bt) if t and t.strip() and _needs_translation(t) else None
+            for t, bt in zip(korean_texts, bubble_types)
+        ]
+        cached = [
+            self.cache.get(k) if k else (None if _needs_translation(t) else t)
+            for k, t in zip(keys, korean_texts)
+        ]
+
+        misses = []
+        seen = set()
+        for i, (key, hit) in enumerate(zip(keys, cached)):
+            if hit is not None or (key is not None and key in seen):
+                continue
+            seen.add(key)
+            misses.append(i)
+        return keys, cached, misses
+
+    def _cached_batch_result(self, keys, cached, korean_texts):
+        """(translations, debug info) for a batch needing no API call."""
+        log.info("  ✓ All %d bubbles served from translation cache or passed through", len(cached))
+        return cached, {
+            'prompt': 'CACHED',
+            'response': '',
+            'count': len(cached),
+            'cache_hits': sum(key is not None for key in keys),
+            'korean_texts': korean_texts,
+            'translations': cached
+        }
+
+    def _merge_cached(self, keys, cached, misses, result):
+        """Store fresh translations and fan them back out between the cache hits."""
+        translations, debug_info = result
+        merged = list(cached)
+        fresh = {}
+
+        for i, trans in zip(misses, translations):
+            merged[i] = trans
+            if keys[i]:
+                fresh[keys[i]] = trans
+                if trans not in self.UNCACHEABLE:
+                    self.cache.set(keys[i], trans)
+
+        # Duplicates of a sent string reuse its translation
+        for i, key in enumerate(keys):
+            if merged[i] is None:
+                merged[i] = fresh[key]
+
+        debug_info['cache_hits'] = sum(hit is not None and key is not None for key, hit in zip(keys, cached))
+        debug_info['translations'] = merged
+        return merged, debug_info
+
+    def _build_batch_content(self, bubble_crops, korean_texts, bubble_types, full_image):
+        """
+        Build the prompt and content list for a batch request.
+
+        Args:
+            bubble_crops: List of PIL Images (cropped bubble regions)
+            korean_texts: List of str (OCR-detected Korean text for each bubble)
+            bubble_types: List of str (normal/shout/whisper), sent as tone tags
+            full_image: PIL Image (full page for context), or None when the page
+                is already in a context cache
 
+        Returns:
+            Tuple[str, list]: (prompt, content parts)
+        """
         count = len(bubble_crops)
         prompt = self.BATCH_PROMPT.format(count=count)
 
-        print("\n" + "="*80, flush=True)
-        print("GEMINI API PROMPT:", flush=True)
-        print("="*80, flush=True)
-        print(prompt, flush=True)
-        print("="*80, flush=True)
-        print(f"Sending: 1 full page + {count} bubbles with Korean text:", flush=True)
-        for i, korean in enumerate(korean_texts):
-            print(f"  [{i+1}] Korean: {korean}", flush=True)
-        print("="*80 + "\n", flush=True)
+        if log.isEnabledFor(logging.DEBUG):
+            rule = "=" * 80
+            page_note = "1 full page" if full_image is not None else "cached page"
+            bubble_lines = "\n".join(
+                f"  [{i+1}] ({bubble_type}) Korean: {korean}"
+                for i, (korean, bubble_type) in enumerate(zip(korean_texts, bubble_types))
+            )
+            log.debug("%s\nGEMINI API PROMPT:\n%s\n%s\n%s\nSending: %s + %d bubbles with Korean text:\n%s\n%s",
+                      rule, rule, prompt, rule, page_note, count, bubble_lines, rule)
 
-        try:
-            # Build content list: prompt + all bubble images + full page context
-            content = [prompt]
+        # Build content list: prompt + all bubble images + full page context
+        content = [prompt]
 
-            # Add full page for context first
+        # Add full page for context first (unless it comes from the context cache)
+        if full_image is not None:
             content.append("\nFull manhwa page for context:")
-            content.append(full_image)
-
-            # Add each bubble with its Korean text and image
-            for i, (crop, korean_text) in enumerate(zip(bubble_crops, korean_texts)):
-                content.append(f"\n[{i+1}] Korean text: {korean_text}")
-                content.append(f"[{i+1}] Image:")
-                content.append(crop)
-
-            print(f"  ⏳ Calling Gemini API with {count} bubbles...", flush=True)
-
-            # Single API call for all bubbles
-            response = self.model.generate_content(
-                content,
-                generation_config={
-                    'temperature': 0.2,  # Lower temperature for more consistent format
-                    'max_output_tokens': 2000  # More tokens for longer responses
-                }
+            content.append(self._prepare_image(full_image, self.PAGE_MAX_SIDE))
+
+        # Add each bubble with its tone tag, Korean text and image
+        for i, (crop, korean_text, bubble_type) in enumerate(zip(bubble_crops, korean_texts, bubble_types)):
+            content.append(f"\n[{i+1}] ({bubble_type}) Korean: {korean_text}")
+            content.append(f"[{i+1}] Image:")
+            content.append(self._prepare_image(crop, self.CROP_MAX_SIDE))
+
+        return prompt, content
+
+    def prepare_async(self, bubble_crops, full_image=None):
+        """
+        Encode a batch's images on the background pool.
+
+        Submit the next batch's images while the current call is in flight and
+        pass the Future as prepared= to translate_bubbles_batch(_async).
+
+        Args:
+            bubble_crops: List of PIL Images (cropped bubble regions)
+            full_image: PIL Image (full page for context), or None
+
+        Returns:
+            Future[Tuple[list, Part or None]]: (crop parts, page part)
+        """
+        return self._prep_pool.submit(self._prepare_images, bubble_crops, full_image)
+
+    def _prepare_images(self, bubble_crops, full_image=None):
+        """Encode all crops (and the page, if given) for upload."""
+        crop_parts = [self._prepare_image(crop, self.CROP_MAX_SIDE) for crop in bubble_crops]
+        page_part = self._prepare_image(full_image, self.PAGE_MAX_SIDE) if full_image is not None else None
+        return crop_parts, page_part
+
+    def _select_prepared(self, prepared, misses, with_page):
+        """Pick the uncached bubbles' parts out of a prepare_async result."""
+        crop_parts, page_part = prepared
+        return [crop_parts[i] for i in misses], page_part if with_page else None
+
+    def _prepare_image(self, img, max_side, quality=None):
+        """
+        Downscale an image to fit max_side and encode it as JPEG for upload.
+
+        Args:
+            img: PIL Image
+            max_side: int (longest side in pixels)
+            quality: JPEG quality (default JPEG_QUALITY)
+
+        Returns:
+            types.Part with JPEG bytes, or img unchanged when raw_images is set
+                or it is already prepared
+        """
+        if self.raw_images or isinstance(img, types.Part):
+            return img
+
+        # resize() returns a new image, so the caller's page/crop is untouched
+        width, height = img.size
+        if max(width, height) > max_side:
+            scale = max_side / max(width, height)
+            img = img.resize(
+                (max(1, round(width * scale)), max(1, round(height * scale))),
+                Image.LANCZOS
             )
 
-            # Parse response: extract [1], [2], [3] translations
-            text = response.text.strip()
+        buf = io.BytesIO()
+        img.convert('RGB').save(buf, 'JPEG', quality=quality or self.JPEG_QUALITY, optimize=True)
+        return types.Part.from_bytes(data=buf.getvalue(), mime_type='image/jpeg')
 
-            print("\n" + "="*80, flush=True)
-            print("GEMINI API RESPONSE:", flush=True)
-            print("="*80, flush=True)
-            print(text, flush=True)
-            print("="*80 + "\n", flush=True)
+    def _pick_client(self, page_cache_handle=None):
+        """Next client round-robin, or the one owning page_cache_handle."""
+        if page_cache_handle:
+            return self._cache_clients.get(page_cache_handle, self.client)
+        return next(self._client_cycle)
 
-            translations = self._parse_batch_response(text, count)
+    def _rate_delay(self, client, korean_texts, image_count):
+        """
+        Reserve one request and its estimated tokens from the client's quota.
 
-            print("PARSED TRANSLATIONS:", flush=True)
-            for i, trans in enumerate(translations):
-                print(f"  [{i+1}] → '{trans}'", flush=True)
-            print("", flush=True)
+        Reservations are taken in arrival order, so a later call always waits
+        at least as long as an earlier one. If the quota can't free up within
+        RATE_MAX_DELAY nothing is reserved and the call must not be sent.
 
-            # Return translations and debug info
-            debug_info = {
-                'prompt': prompt,
-                'response': text,
-                'count': count,
-                'translations': translations
-            }
-            return translations, debug_info
+        Returns:
+            float: seconds to wait before calling
 
-        except Exception as e:
-            print(f"[ERROR] Batch translation failed: {type(e).__name__}: {e}", flush=True)
-            # Fallback to individual translations
-            debug_info = {
-                'prompt': prompt,
-                'response': f'ERROR: {str(e)}',
-                'count': count,
-                'translations': ["[Translation failed]"] * count
-            }
-            return ["[Translation failed]"] * count, debug_info
+        Raises:
+            RateLimitExceeded: quota exhausted beyond RATE_MAX_DELAY
+        """
+        requests, tokens = self._limiters.get(id(client), (None, None))
+        if requests is None:
+            return 0.0
 
-    def _parse_batch_response(self, text, expected_count):
-        """Parse batch translation response into individual translations."""
-        import re
+        estimated_tokens = sum(len(t) for t in korean_texts) * 2 + image_count * self.IMAGE_TOKENS
+        request_delay = requests.reserve(1, self.RATE_MAX_DELAY)
+        token_delay = tokens.reserve(estimated_tokens, self.RATE_MAX_DELAY) if request_delay is not None else None
+        if token_delay is None:
+            if request_delay is not None:
+                requests.refund(1)
+            raise RateLimitExceeded(f"Rate limit: quota exhausted beyond {self.RATE_MAX_DELAY:.0f}s")
+
+        delay = max(request_delay, token_delay)
+        if delay:
+            log.info("  ⏳ Rate limit: waiting %.1fs before calling Gemini", delay)
+        return delay
+
+    def _batch_config(self, page_cache_handle=None):
+        """Generation config for a batch call, referencing the page cache if any."""
+        if not page_cache_handle:
+            return self.BATCH_CONFIG
+        # The system instruction lives in the cache; the API rejects it alongside cached_content
+        return self.BATCH_CONFIG.model_copy(
+            update={'cached_content': page_cache_handle, 'system_instruction': None}
+        )
+
+    @classmethod
+    def plan_batches(cls, areas):
+        """
+        Group bubbles into translation batches by crop area.
+
+        Bubbles are packed smallest-first until a batch would exceed
+        BATCH_MAX_PIXELS or BATCH_SIZE bubbles.
+
+        Args:
+            areas: sequence of crop areas (width * height), one per bubble ID
 
-        translations = []
-        # Find all [N] translation patterns
-        pattern = r'\[(\d+)\]\s*(.+?)(?=\[\d+\]|$)'
-        matches = re.findall(pattern, text, re.DOTALL)
+        Returns:
+            list of lists of bubble IDs
+        """
+        batches = []
+        current = []
+        current_pixels = 0
+        for idx in sorted(range(len(areas)), key=lambda i: int(areas[i])):
+            area = int(areas[idx])
+            if current and (current_pixels + area > cls.BATCH_MAX_PIXELS
+                            or len(current) >= cls.BATCH_SIZE):
+                batches.append(current)
+                current = []
+                current_pixels = 0
+            current.append(idx)
+            current_pixels += area
 
-        for num, translation in matches:
-            translations.append(translation.strip())
+        if current:
+            batches.append(current)
 
-        # Ensure we have the right count
-        while len(translations) < expected_count:
-            translations.append("[Translation failed]")
+        return batches
 
-        return translations[:expected_count]
+    def has_cache_misses(self, korean_texts, bubble_types):
+        """Whether a batch would call the API (anything not cached or passed through)."""
+        if self.test_mode:
+            return False
+        bubble_types = [bubble_type or 'normal' for bubble_type in bubble_types]
+        return bool(self._lookup_cached(korean_texts, bubble_types)[2])
 
-    def translate_bubble(self, crop_image, full_image, bubble_type):
+    def prime_page_context(self, full_image):
         """
-        Translate a single bubble using Gemini API.
+        Upload the full page once as cached context for all of its batches.
+
+        Caching can be refused (e.g. a small page below the model's minimum
+        cacheable token count); callers then send full_image inline as before.
 
         Args:
-            crop_image: PIL Image (cropped bubble region)
             full_image: PIL Image (full page for context)
-            bubble_type: str (normal/shout/whisper)
 
         Returns:
-            str: Translated English text
+            str or None: cache handle for page_cache_handle, None if not cached
         """
-        # Test mode: return dummy text to test font sizing
         if self.test_mode:
-            return "Test Translation"
-
-        prompt = self.PROMPTS.get(bubble_type, self.PROMPTS['normal'])
+            return None
 
+        client = self._pick_client()
         try:
-            # Send both crop and full context to Gemini
-            response = self.model.generate_content(
-                [
-                    prompt,
-                    crop_image,
-                    "Full page context:",
-                    full_image
-                ],
-                generation_config={
-                    'temperature': 0.3,
-                    'max_output_tokens': 100
-                }
+            delay = self._rate_delay(client, [], 1)
+            if delay:
+                time.sleep(delay)
+
+            cache = client.caches.create(
+                model=self.MODEL_NAME,
+                config=types.CreateCachedContentConfig(
+                    contents=[
+                        "Full manhwa page for context:",
+                        self._prepare_image(full_image, self.PAGE_MAX_SIDE)
+                    ],
+                    system_instruction=self.BATCH_SYSTEM_INSTRUCTION,
+                    ttl=self.PAGE_CACHE_TTL,
+                    display_name='gemator-page'
+                )
             )
+            log.info("  ✓ Cached page context as %s", cache.name)
+            self._cache_clients[cache.name] = client
+            return cache.name
 
-            text = response.text.strip()
-            if not text:
-                return "[No text detected]"
+        except Exception as e:
+            log.warning("  ⚠️  Page context caching unavailable, sending page inline: %s: %s", type(e).__name__, e)
+            return None
 
-            return text
+    def release_page_context(self, page_cache_handle):
+        """Delete a page context cache at end of page (it would expire via TTL anyway)."""
+        if not page_cache_handle or self.test_mode:
+            return
 
+        try:
+            self._cache_clients.pop(page_cache_handle, self.client).caches.delete(name=page_cache_handle)
         except Exception as e:
-            print(f"[ERROR] Gemini API error: {type(e).__name__}: {e}")
-            import traceback
-            traceback.print_exc()
-            # Retry once after 2 seconds
-            time.sleep(2)
+            log.warning("  ⚠️  Failed to delete page cache %s: %s: %s", page_cache_handle, type(e).__name__, e)
 
-            try:
-                response = self.model.generate_content(
-                    [prompt, crop_image],
-                    generation_config={
-                        'temperature': 0.3,
-                        'max_output_tokens': 100
+    def _finish_batch(self, prompt, text, count):
+        """Parse a batch API response text into (translations, debug info)."""
+        # Parse response: extract [1], [2], [3] translations
+        text = (text or '').strip()
+
+        translations = self._parse_batch_response(text, count)
+
+        if log.isEnabledFor(logging.DEBUG):
+            rule = "=" * 80
+            parsed_lines = "\n".join(f"  [{i+1}] → '{trans}'" for i, trans in enumerate(translations))
+            log.debug("%s\nGEMINI API RESPONSE:\n%s\n%s\n%s\nPARSED TRANSLATIONS:\n%s",
+                      rule, rule, text, rule, parsed_lines)
+
+        # Return translations and debug info
+        debug_info = {
+            'prompt': prompt,
+            'response': text,
+            'count': count,
+            'translations': translations
+        }
+        return translations, debug_info
+
+    def _fan_out(self, keys, cached, misses):
+        """Sent slot -> every bubble index it answers (duplicates share one slot)."""
+        return [
+            [i for i, key in enumerate(keys) if key is not None and key == keys[m] and cached[i] is None] or [m]
+            for m in misses
+        ]
+
+    def _failed_stream(self, stream, prompt, count, error):
+        """_failed_batch for a stream, keeping the slots that completed before the error."""
+        translations, debug_info = self._failed_batch(prompt, count, error)
+        translations = stream.salvage(translations)
+        debug_info['translations'] = translations
+        return translations, debug_info
+
+    def _failed_batch(self, prompt, count, error):
+        """Fallback (translations, debug info) when a batch call fails."""
+        log.error("[ERROR] Batch translation failed: %s: %s", type(error).__name__, error)
+        debug_info = {
+            'prompt': prompt,
+            'response': f'ERROR: {str(error)}',
+            'count': count,
+            'translations': ["[Translation failed]"] * count
+        }
+        return ["[Translation failed]"] * count, debug_info
+
+    def translate_pages(self, pages):
+        """
+        Translate bubble batches from many pages, routed by self.mode.
+
+        In 'sync' mode each batch is a regular API call, with the next batch's
+        images encoded in the background while it is in flight; in 'batch'
+        mode all batches go into one Batch API job and this blocks until it
+        finishes.
+
+        Args:
+            pages: List of pages, each a list of
+                (bubble_crops, korean_texts, bubble_types, full_image) batches
+
+        Returns:
+            dict: 'page{p}_batch{b}' -> (translations, debug info)
+        """
+        if self.mode == 'batch' and not self.test_mode:
+            return self.poll_and_collect(self.submit_batch_job(pages))
+
+        jobs = [(f"page{p}_batch{b}", batch) for p, page in enumerate(pages) for b, batch in enumerate(page)]
+        results = {}
+
+        pending = self.prepare_async(jobs[0][1][0], jobs[0][1][3]) if jobs else None
+        for n, (key, batch) in enumerate(jobs):
+            prepared = pending
+            if n + 1 < len(jobs):
+                next_batch = jobs[n + 1][1]
+                pending = self.prepare_async(next_batch[0], next_batch[3])
+            results[key] = self.translate_bubbles_batch(*batch, prepared=prepared)
+
+        return results
+
+    def submit_batch_job(self, all_pages, display_name='gemator-batch'):
+        """
+        Submit bubble batches from many pages as one Gemini Batch API job.
+
+        Each batch becomes one JSONL request with the same content that
+        translate_bubbles_batch would send.
+
+        Args:
+            all_pages: List of pages, each a list of
+                (bubble_crops, korean_texts, bubble_types, full_image) batches
+            display_name: str (job name shown in the console)
+
+        Returns:
+            types.BatchJob: submitted job (pass to poll_and_collect)
+        """
+        generation_config = self.BATCH_CONFIG.model_dump(
+            mode='json', by_alias=True, exclude_none=True, exclude={'system_instruction'}
+        )
+        system_instruction = {'parts': [{'text': self.BATCH_SYSTEM_INSTRUCTION}]}
+        expected = {}
+        lines = []
+
+        for p, page in enumerate(all_pages):
+            for b, (bubble_crops, korean_texts, bubble_types, full_image) in enumerate(page):
+                key = f"page{p}_batch{b}"
+                prompt, content = self._build_batch_content(bubble_crops, korean_texts, bubble_types, full_image)
+                expected[key] = (prompt, len(bubble_crops))
+                lines.append(json.dumps({
+                    'key': key,
+                    'request': {
+                        'contents': [{'role': 'user', 'parts': self._content_to_parts(content)}],
+                        'systemInstruction': system_instruction,
+                        'generationConfig': generation_config
                     }
-                )
-                return response.text.strip() or "[No text detected]"
+                }, ensure_ascii=False))
+
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False, encoding='utf-8') as f:
+            f.write('\n'.join(lines))
+            jsonl_path = f.name
+
+        try:
+            uploaded = self.client.files.upload(
+                file=jsonl_path,
+                config=types.UploadFileConfig(display_name=display_name, mime_type='jsonl')
+            )
+        finally:
+            os.remove(jsonl_path)
+
+        batch_job = self.client.batches.create(
+            model=self.MODEL_NAME,
+            src=uploaded.name,
+            config={'display_name': display_name}
+        )
+        self._batch_jobs[batch_job.name] = expected
+        log.info("✓ Submitted batch job %s with %d requests", batch_job.name, len(lines))
+        return batch_job
+
+    def poll_and_collect(self, batch_job, poll_interval=None):
+        """
+        Wait for a Batch API job to finish and parse its results.
+
+        Args:
+            batch_job: types.BatchJob returned by submit_batch_job
+            poll_interval: seconds between status checks (default BATCH_POLL_SECONDS)
+
+        Returns:
+            dict: 'page{p}_batch{b}' -> (translations, debug info); batches
+                without a result get the usual "[Translation failed]" fallback
+        """
+        poll_interval = poll_interval or self.BATCH_POLL_SECONDS
+        expected = self._batch_jobs.pop(batch_job.name, {})
+
+        job = batch_job
+        while job.state.name not in self.BATCH_DONE_STATES:
+            time.sleep(poll_interval)
+            job = self.client.batches.get(name=job.name)
 
-            except Exception as retry_error:
-                print(f"[ERROR] Gemini retry failed: {type(retry_error).__name__}: {retry_error}")
-                import traceback
-                traceback.print_exc()
-                return "[Translation failed]"
+        results = {}
+        if job.state.name in self.BATCH_RESULT_STATES and job.dest and job.dest.file_name:
+            data = self.client.files.download(file=job.dest.file_name)
+            for line in data.decode('utf-8').splitlines():
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                key = item.get('key')
+                if key not in expected:
+                    continue
+
+                prompt, count = expected[key]
+                if 'response' in item:
+                    response = types.GenerateContentResponse.model_validate(item['response'])
+                    results[key] = self._finish_batch(prompt, response.text, count)
+                else:
+                    results[key] = self._failed_batch(prompt, count, RuntimeError(item.get('error')))
+
+        # Anything missing (failed/expired job or dropped lines) falls back
+        for key, (prompt, count) in expected.items():
+            if key not in results:
+                results[key] = self._failed_batch(prompt, count, RuntimeError(f"Batch job {job.state.name}"))
+
+        return results
+
+    def _content_to_parts(self, content):
+        """Convert a content list (str / PIL Image / Part) to Batch API JSON parts."""
+        parts = []
+        for item in content:
+            if isinstance(item, types.Part):
+                part = item
+            elif isinstance(item, Image.Image):
+                buf = io.BytesIO()
+                item.save(buf, 'PNG')
+                part = types.Part.from_bytes(data=buf.getvalue(), mime_type='image/png')
+            else:
+                part = types.Part(text=item)
+            parts.append(part.model_dump(mode='json', by_alias=True, exclude_none=True))
+        return parts
+
+    def _parse_batch_response(self, text, expected_count):
+        """
+        Parse batch translation response into individual translations.
+
+        Single pass over "[N] translation" lines; each goes to slot N, so
+        reordered or skipped numbers land in the right place.
+        """
+        translations = ["[Translation failed]"] * expected_count
+        current = None
+
+        for line in text.splitlines():
+            current = self._scan_batch_line(line, translations, current)
+
+        return translations
+
+    def _scan_batch_line(self, line, translations, current):
+        """
+        Apply one response line to translations in place.
+
+        Args:
+            line: str (one line of the response)
+            translations: List of str, one slot per expected translation
+            current: slot index the previous line belonged to, or None
+
+        Returns:
+            int or None: slot index this line belongs to
+        """
+        line = line.strip()
+        if not line:
+            return current
+
+        rb = line.find(']') if line.startswith('[') else -1
+        if rb >= 2 and line[1:rb].isdigit():
+            n = int(line[1:rb])
+            current = n - 1 if 1 <= n <= len(translations) else None
+            if current is not None:
+                translations[current] = line[rb + 1:].strip() or translations[current]
+        elif current is not None:
+            # Wrapped continuation of the previous translation (or its text after a bare "[N]")
+            prev = translations[current]
+            translations[current] = line if prev == "[Translation failed]" else f"{prev} {line}"
+
+        return current
+
+    def translate_bubble(self, crop_image, full_image, bubble_type, korean_text=''):
+        """
+        Translate a single bubble (a one-item batch; prefer batching whole pages).
+
+        Args:
+            crop_image: PIL Image (cropped bubble region)
+            full_image: PIL Image (full page for context)
+            bubble_type: str (normal/shout/whisper)
+            korean_text: str (OCR-detected Korean text, if known)
+
+        Returns:
+            str: Translated English text
+        """
+        translations, _ = self.translate_bubbles_batch([crop_image], [korean_text], [bubble_type], full_image)
+        return translations[0]